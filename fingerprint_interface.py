@@ -14,8 +14,7 @@ import argparse
 import asyncio
 from enum import Enum
 import logging
-
-from fp_opcua_server.fp_opcua_server import FpOpcuaServer
+import signal
 
 
 class IntegrationLevel(Enum):
@@ -29,11 +28,21 @@ async def run_opcua_server(opcua_server, sensor_system):
     await opcua_server.bind_sensor(sensor_system)
     await opcua_server.load_nodesets()
     await opcua_server.initialize_nodeset()
+    # Suspend until a shutdown signal arrives, instead of waking up periodically.
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            pass    # e.g. on Windows: KeyboardInterrupt still ends asyncio.run().
     async with opcua_server.server:
         print("Fingerprint OPCUA server is listening...")
-        while True:
-            await asyncio.sleep(0.5)  # seconds
-            # print([t.get_name() for t in opcua_server.tasks_running])    # debug info
+        try:
+            await stop_event.wait()
+            print("\nStopped by signal.")
+        finally:
+            await opcua_server.cancel_tasks()
 
 
 if __name__ == "__main__":
@@ -83,7 +92,9 @@ if __name__ == "__main__":
     else:
         raise SystemExit(f"Exit: Integration level '{level}' is out of range.")
 
-    # Set up Opcua server and run it.
+    # Set up Opcua server and run it. Imported only now, so argument errors exit without loading
+    # the asyncua stack.
+    from fp_opcua_server.fp_opcua_server import FpOpcuaServer
     opcua_server = FpOpcuaServer()
     try:
         asyncio.run(run_opcua_server(opcua_server, sensor_system))  # debugging: debug=True
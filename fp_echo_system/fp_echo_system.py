@@ -4,16 +4,32 @@
 # SPDX-License-Identifier: MIT
 
 """Placeholder class for a Track & Trace Fingerprint system. It exhibits the basic function set of
- a real system, but most functions print only a notification that they were called. The call
+ a real system, but most functions log only a notification that they were called. The call
  validation is disabled as well."""
 
 __version__ = 1.02
 
 import asyncio
+import functools
+import logging
+from types import MappingProxyType
 from fp_tcpip_system.fp_tcp_clients.fp_tcp_interface_definitions import RunState, ResultState, \
     ErrorType, FpStatus
 
 
+logger = logging.getLogger(__name__)
+
+
+def serialized(func):
+    """Decorator for service methods: run the method body while holding the instance's
+        task_lock, so that those services are executed one after another."""
+    @functools.wraps(func)
+    async def serialized_func(self, *args, **kwargs):
+        async with self.task_lock:
+            return await func(self, *args, **kwargs)
+    return serialized_func
+
+
 class FpEchoSystem:
     def __init__(self):
         # Set up Fingerprint system representing values.
@@ -33,69 +49,76 @@ class FpEchoSystem:
             'trace_part': 2100,
         }
 
+        # The prior info of each service is constant, so build it once. Read-only views prevent
+        # callers from altering the shared dicts.
+        self._prior_info_cache = {
+            name: MappingProxyType({
+                'ExpectedServiceExecutionDuration': duration,  # ms
+                'ServiceTriggerResult': 1,            # 1=accepted
+                'ServiceResultMessage': "",
+                'ServiceResultCode': 0,
+            })
+            for name, duration in self.duration_estimations.items()
+        }
+
+        # The same durations in seconds, as needed for the delay simulations.
+        self._sleep_s = {name: duration / 1000. for name, duration in
+                         self.duration_estimations.items()}
+
     async def _get_status(self):
         return self.status.as_dict()
 
+    async def _simulate_duration(self, duration, command):
+        """Sleep for duration (in seconds) at a single scheduling point. After 40% of it, the
+            status switches from image acquisition to COMMAND_RUNNING via a timer callback."""
+        handle = asyncio.get_running_loop().call_later(
+            duration * 0.4, self.status.update, RunState.COMMAND_RUNNING,
+            ResultState.RESULT_UNDEFINED, ErrorType.NO_ERROR, command)
+        try:
+            await asyncio.sleep(duration)
+        finally:
+            handle.cancel()     # no-op unless the sleep was cancelled early
+
+    @serialized
     async def reset_system(self, *args):
-        async with self.task_lock:
-            print("FPSystem-->reset_system.", args)
-            self.status.reset()
-            await asyncio.sleep(self.duration_estimations['reset_system'] / 1000.)  # seconds
-            self.status.update(RunState.SYSTEM_READY, ResultState.RESULT_UNDEFINED,
-                               ErrorType.NO_ERROR, '')
-            print("FPSystem-->reset_system finished.")
-            return {}
+        logger.debug("FPSystem-->reset_system. %s", args)
+        self.status.reset()
+        await asyncio.sleep(self._sleep_s['reset_system'])  # seconds
+        self.status.update(RunState.SYSTEM_READY, ResultState.RESULT_UNDEFINED,
+                           ErrorType.NO_ERROR, '')
+        logger.debug("FPSystem-->reset_system finished.")
+        return {}
 
     def reset_system_prior_info(self, *args):
         # For echoing input no requirements must be fulfilled.
-        prior_info = {
-            'ExpectedServiceExecutionDuration': self.duration_estimations['reset_system'],  # ms
-            'ServiceTriggerResult': 1,            # 1=accepted
-            'ServiceResultMessage': "",
-            'ServiceResultCode': 0,
-        }
-        return prior_info
+        return self._prior_info_cache['reset_system']
 
     async def get_status(self, *args):
-        async with self.task_lock:
-            """Return the status of the fingerprint system."""
-            print("FPSystem-->get_status.", args)
-            await asyncio.sleep(self.duration_estimations['get_status'] / 1000.)
-            print("FPSystem-->get_status finished.")
-            return self._get_status()
+        """Return the status of the fingerprint system. Can be run parallel to other tasks."""
+        logger.debug("FPSystem-->get_status. %s", args)
+        await asyncio.sleep(self._sleep_s['get_status'])
+        logger.debug("FPSystem-->get_status finished.")
+        return self._get_status()
 
     def get_status_prior_info(self, *args):
         # For echoing input no requirements must be fulfilled.
-        prior_info = {
-            'ExpectedServiceExecutionDuration': self.duration_estimations['get_status'],  # ms
-            'ServiceTriggerResult': 1,            # 1=accepted
-            'ServiceResultMessage': "",
-            'ServiceResultCode': 0,
-        }
-        return prior_info
+        return self._prior_info_cache['get_status']
 
+    @serialized
     async def set_image_matching_type(self, *args):
         """Activates the image matching algorithm for a certain part type."""
-        async with self.task_lock:
-            print("FPSystem-->set_image_matching_type.", args)
-            self.status.update(RunState.COMMAND_RUNNING, ResultState.RESULT_UNDEFINED,
-                               ErrorType.NO_ERROR, 'set_image_matching_type')
-            await asyncio.sleep(self.duration_estimations['set_image_matching_type'] / 1000.)
-            self.status.update(RunState.SYSTEM_READY, ResultState.RESULT_READY, ErrorType.NO_ERROR,
-                               '')
-            print("FPSystem-->set_image_matching_type finished.")
-            return {}
+        logger.debug("FPSystem-->set_image_matching_type. %s", args)
+        self.status.update(RunState.COMMAND_RUNNING, ResultState.RESULT_UNDEFINED,
+                           ErrorType.NO_ERROR, 'set_image_matching_type')
+        await asyncio.sleep(self._sleep_s['set_image_matching_type'])
+        self.status.update(RunState.SYSTEM_READY, ResultState.RESULT_READY, ErrorType.NO_ERROR,
+                           '')
+        logger.debug("FPSystem-->set_image_matching_type finished.")
+        return {}
 
     def set_image_matching_type_prior_info(self, *args):
         # For echoing input no requirements must be fulfilled.
-        prior_info = {
-            'ExpectedServiceExecutionDuration':
-                self.duration_estimations['set_image_matching_type'],  # ms
-            'ServiceTriggerResult': 1,            # 1=accepted
-            'ServiceResultMessage': "",
-            'ServiceResultCode': 0,
-        }
-        return prior_info
+        return self._prior_info_cache['set_image_matching_type']
 
     def _sync_success_prior_info(self):
         # Currently unused, since all commands are implemented async.
@@ -107,64 +130,46 @@ class FpEchoSystem:
         }
         return prior_info
 
+    @serialized
     async def add_part(self, *args):
-        async with self.task_lock:
-            print("FPSystem-->add_part.", args)
-            self.status.update(RunState.ACQUIRING_IMAGE, ResultState.RESULT_UNDEFINED,
-                               ErrorType.NO_ERROR, 'add_part')
-            await asyncio.sleep(self.duration_estimations['add_part'] / 1000. * 0.4)
-            self.status.update(RunState.COMMAND_RUNNING, ResultState.RESULT_UNDEFINED,
-                               ErrorType.NO_ERROR, 'add_part')
-            await asyncio.sleep(self.duration_estimations['add_part'] / 1000. * 0.6)
-            self.status.update(RunState.SYSTEM_READY, ResultState.RESULT_READY,
-                               ErrorType.NO_ERROR, '')
-            print("FPSystem-->add_part finished.")
-            res = {
-                'ServiceExecutionResult': 0,    # 0=success
-                'PartIDsOfDuplicates': "",
-            }
-            return res
+        logger.debug("FPSystem-->add_part. %s", args)
+        self.status.update(RunState.ACQUIRING_IMAGE, ResultState.RESULT_UNDEFINED,
+                           ErrorType.NO_ERROR, 'add_part')
+        await self._simulate_duration(self._sleep_s['add_part'], 'add_part')
+        self.status.update(RunState.SYSTEM_READY, ResultState.RESULT_READY,
+                           ErrorType.NO_ERROR, '')
+        logger.debug("FPSystem-->add_part finished.")
+        res = {
+            'ServiceExecutionResult': 0,    # 0=success
+            'PartIDsOfDuplicates': "",
+        }
+        return res
 
     def add_part_prior_info(self, *args):
         # For echoing input no requirements must be fulfilled.
-        prior_info = {
-            'ExpectedServiceExecutionDuration': self.duration_estimations['add_part'],  # ms
-            'ServiceTriggerResult': 1,            # 1=accepted
-            'ServiceResultMessage': "",
-            'ServiceResultCode': 0,
-        }
-        return prior_info
+        return self._prior_info_cache['add_part']
 
+    @serialized
     async def trace_part(self, *args):
-        async with self.task_lock:
-            print("FPSystem-->trace_part.", args)
-            self.status.update(RunState.ACQUIRING_IMAGE, ResultState.RESULT_UNDEFINED,
-                               ErrorType.NO_ERROR, 'trace_part')
-            await asyncio.sleep(self.duration_estimations['trace_part'] / 1000 * 0.4)
-            self.status.update(RunState.COMMAND_RUNNING, ResultState.RESULT_UNDEFINED,
-                               ErrorType.NO_ERROR, 'trace_part')
-            await asyncio.sleep(self.duration_estimations['trace_part'] / 1000 * 0.6)
-            self.status.update(RunState.SYSTEM_READY, ResultState.RESULT_READY, ErrorType.NO_ERROR,
-                               '')
-            print("FPSystem-->trace_part finished.")
-            res = {
-                'ServiceExecutionResult': 0,    # 0=success
-                'PartID': "",
-                'BatchID': "",
-                'PartType': "",
-                'CurrentConfidenceValue1': 99,
-                'CurrentConfidenceValue2': 100,
-                'AverageConfidenceValue1': 97,
-                'AverageConfidenceValue2': 98,
-            }
-            return res
+        logger.debug("FPSystem-->trace_part. %s", args)
+        self.status.update(RunState.ACQUIRING_IMAGE, ResultState.RESULT_UNDEFINED,
+                           ErrorType.NO_ERROR, 'trace_part')
+        await self._simulate_duration(self._sleep_s['trace_part'], 'trace_part')
+        self.status.update(RunState.SYSTEM_READY, ResultState.RESULT_READY, ErrorType.NO_ERROR,
+                           '')
+        logger.debug("FPSystem-->trace_part finished.")
+        res = {
+            'ServiceExecutionResult': 0,    # 0=success
+            'PartID': "",
+            'BatchID': "",
+            'PartType': "",
+            'CurrentConfidenceValue1': 99,
+            'CurrentConfidenceValue2': 100,
+            'AverageConfidenceValue1': 97,
+            'AverageConfidenceValue2': 98,
+        }
+        return res
 
     def trace_part_prior_info(self, *args):
         # For echoing input no requirements must be fulfilled.
-        prior_info = {
-            'ExpectedServiceExecutionDuration': self.duration_estimations['trace_part'],  # ms
-            'ServiceTriggerResult': 1,            # 1=accepted
-            'ServiceResultMessage': "",
-            'ServiceResultCode': 0,
-        }
-        return prior_info
+        return self._prior_info_cache['trace_part']
@@ -10,22 +10,97 @@
 __version__ = 1.01
 
 import asyncio
-from dataclasses import dataclass
-from random import randint
+import functools
+import itertools
+import logging
+from types import MappingProxyType
+from dataclasses import dataclass, field
+from random import choice
 from fp_tcpip_system.fp_tcp_clients.fp_tcp_interface_definitions import RunState, ResultState, \
     ErrorType, FpStatus
 
 
+logger = logging.getLogger(__name__)
+
+
+def serialized(func):
+    """Decorator for service methods: run the method body while holding the instance's
+        task_lock, so that those services are executed one after another."""
+    @functools.wraps(func)
+    async def serialized_func(self, *args, **kwargs):
+        async with self.task_lock:
+            return await func(self, *args, **kwargs)
+    return serialized_func
+
+
 FINGERPRINT_SIZE = 0
+# Widths of the pseudo fingerprint parts: part id, batch id, part type.
+_FP_PAD_ID = _FP_PAD_BATCH = FINGERPRINT_SIZE // 3
+_FP_PAD_TYPE = FINGERPRINT_SIZE // 3 + FINGERPRINT_SIZE % 3
 
 
-@dataclass(frozen=True, eq=True)
+@dataclass(frozen=True, eq=True, slots=True)
 class FpDatabaseEntry:
     """Database entries are bytes in a real Fingerprint system."""
     fingerprint: str
     part_id: str
     batch_id: str
     part_type: str
+    _hash: int = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        # Entries are immutable and hashed on every set or index operation, so hash them once.
+        object.__setattr__(self, '_hash', hash((self.fingerprint, self.part_id, self.batch_id,
+                                                self.part_type)))
+
+    def __hash__(self):
+        return self._hash
+
+
+@dataclass
+class FpDatabase:
+    """Set of database entries, additionally indexed by part id, fingerprint, batch id and part
+     type. Allows for duplicate checks and filtering without scanning all entries."""
+    entries: set = field(default_factory=set)
+    by_id: dict = field(default_factory=dict, repr=False)   # {part_id: set(FpDatabaseEntry)}
+    by_fp: dict = field(default_factory=dict, repr=False)   # {fingerprint: set(FpDatabaseEntry)}
+    by_batch: dict = field(default_factory=dict, repr=False)  # {batch_id: set(FpDatabaseEntry)}
+    by_type: dict = field(default_factory=dict, repr=False)   # {part_type: set(FpDatabaseEntry)}
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _index_keys(self, fp_entry):
+        return ((self.by_id, fp_entry.part_id), (self.by_fp, fp_entry.fingerprint),
+                (self.by_batch, fp_entry.batch_id), (self.by_type, fp_entry.part_type))
+
+    def add(self, fp_entry):
+        self.entries.add(fp_entry)
+        for index, key in self._index_keys(fp_entry):
+            index.setdefault(key, set()).add(fp_entry)
+
+    def remove(self, fp_entry):
+        self.entries.remove(fp_entry)
+        for index, key in self._index_keys(fp_entry):
+            index[key].discard(fp_entry)
+            if not index[key]:
+                del index[key]
+
+    def select(self, batch_ids=None, part_types=None):
+        """Return the entries with a batch id in batch_ids and a part type in part_types. A filter
+            set to None is not applied."""
+        if batch_ids is None and part_types is None:
+            return self.entries
+        selection = None
+        for index, keys in ((self.by_batch, batch_ids), (self.by_type, part_types)):
+            if keys is None:
+                continue
+            matches = set().union(*(index[key] for key in keys if key in index))
+            selection = matches if selection is None else selection & matches
+        return selection
 
 
 class FpMockupSystem:
@@ -33,9 +108,11 @@ class FpMockupSystem:
         # Set up Fingerprint system representing values.
         self.status = FpStatus()
         self.image_matching = 'default'
-        self.fp_databases = {}  # elements will be {str: set()}
+        self.fp_databases = {}  # elements will be {str: FpDatabase()}
 
         # Set up mockup management.
+        # All services share the run state machine in self.status, including
+        # set_image_matching_type, so a single lock serializes them.
         self.task_lock = asyncio.Lock()  # used to serialize certain tasks.
         self._init_duration_estimations()
 
@@ -49,71 +126,79 @@ class FpMockupSystem:
             'trace_part': 2100,
         }
 
+        # The prior info of each service is constant, so build it once. Read-only views prevent
+        # callers from altering the shared dicts.
+        self._prior_info_cache = {
+            name: MappingProxyType({
+                'ExpectedServiceExecutionDuration': duration,  # ms
+                'ServiceTriggerResult': 1,            # 1=accepted
+                'ServiceResultMessage': "",
+                'ServiceResultCode': 0,
+            })
+            for name, duration in self.duration_estimations.items()
+        }
+
+        # The same durations in seconds, as needed for the delay simulations.
+        self._sleep_s = {name: duration / 1000. for name, duration in
+                         self.duration_estimations.items()}
+
     async def _get_status(self):
         return self.status.as_dict()
 
+    async def _simulate_duration(self, duration, command):
+        """Sleep for duration (in seconds) at a single scheduling point. After 40% of it, the
+            status switches from image acquisition to COMMAND_RUNNING via a timer callback."""
+        handle = asyncio.get_running_loop().call_later(
+            duration * 0.4, self.status.update, RunState.COMMAND_RUNNING,
+            ResultState.RESULT_UNDEFINED, ErrorType.NO_ERROR, command)
+        try:
+            await asyncio.sleep(duration)
+        finally:
+            handle.cancel()     # no-op unless the sleep was cancelled early
+
+    @serialized
     async def reset_system(self):
-        async with self.task_lock:
-            print("FPSystem-->reset_system()")
-            # todo: terminate all running mockup tasks.
-            self.status.reset()
-            await asyncio.sleep(self.duration_estimations['reset_system'] / 1000.)
-            self.status.update(RunState.SYSTEM_READY, ResultState.RESULT_UNDEFINED,
-                               ErrorType.NO_ERROR, '')
-            print("FPSystem-->reset_system finished.\n")
-            return {}
+        logger.debug("FPSystem-->reset_system()")
+        # todo: terminate all running mockup tasks.
+        self.status.reset()
+        await asyncio.sleep(self._sleep_s['reset_system'])
+        self.status.update(RunState.SYSTEM_READY, ResultState.RESULT_UNDEFINED,
+                           ErrorType.NO_ERROR, '')
+        logger.debug("FPSystem-->reset_system finished.")
+        return {}
 
     def reset_system_prior_info(self, *args):
         # For reset_system no requirements must be fulfilled.
-        prior_info = {
-            'ExpectedServiceExecutionDuration': self.duration_estimations['reset_system'],  # ms
-            'ServiceTriggerResult': 1,            # 1=accepted
-            'ServiceResultMessage': "",
-            'ServiceResultCode': 0,
-        }
-        return prior_info
+        return self._prior_info_cache['reset_system']
 
     async def get_status(self):
         """Return the status of the fingerprint system. Can be run parallel to other tasks."""
-        print("FPSystem-->get_status()")
-        await asyncio.sleep(self.duration_estimations['get_status'] / 1000.)
-        print("FPSystem-->get_status finished.\n")
+        logger.debug("FPSystem-->get_status()")
+        await asyncio.sleep(self._sleep_s['get_status'])
+        logger.debug("FPSystem-->get_status finished.")
         return self._get_status()
 
     def get_status_prior_info(self, *args):
         # For get_status no requirements must be fulfilled.
-        prior_info = {
-            'ExpectedServiceExecutionDuration': self.duration_estimations['get_status'],  # ms
-            'ServiceTriggerResult': 1,            # 1=accepted
-            'ServiceResultMessage': "",
-            'ServiceResultCode': 0,
-        }
-        return prior_info
+        return self._prior_info_cache['get_status']
 
+    @serialized
     async def set_image_matching_type(self, image_matching_name):
         """Activates the image matching algorithm for a certain part type."""
-        async with self.task_lock:
-            print(f"FPSystem-->set_image_matching_type( {image_matching_name} )")
-            self.status.update(RunState.COMMAND_RUNNING, ResultState.RESULT_UNDEFINED,
-                               ErrorType.NO_ERROR, 'set_image_matching_type')
-            self.image_matching = str(image_matching_name)
-            await asyncio.sleep(self.duration_estimations['set_image_matching_type'] / 1000.)
+        logger.debug("FPSystem-->set_image_matching_type( %s )", image_matching_name)
+        self.status.update(RunState.COMMAND_RUNNING, ResultState.RESULT_UNDEFINED,
+                           ErrorType.NO_ERROR, 'set_image_matching_type')
+        self.image_matching = str(image_matching_name)
+        await asyncio.sleep(self._sleep_s['set_image_matching_type'])
 
-            self.status.update(RunState.SYSTEM_READY, ResultState.RESULT_READY,
-                               ErrorType.NO_ERROR, '')
-            print("FPSystem-->set_image_matching_type finished.\n")
-            return {}
+        self.status.update(RunState.SYSTEM_READY, ResultState.RESULT_READY,
+                           ErrorType.NO_ERROR, '')
+        logger.debug("FPSystem-->set_image_matching_type finished.")
+        return {}
 
     def set_image_matching_type_prior_info(self, *args):
         # For set_image_matching_type no requirements must be fulfilled.
-        prior_info = {
-            'ExpectedServiceExecutionDuration':
-                self.duration_estimations['set_image_matching_type'],  # ms
-            'ServiceTriggerResult': 1,            # 1=accepted
-            'ServiceResultMessage': "",
-            'ServiceResultCode': 0,
-        }
-        return prior_info
+        return self._prior_info_cache['set_image_matching_type']
 
     def _sync_success_prior_info(self):
         # Currently unused, since all commands are implemented async.
@@ -125,221 +210,195 @@ class FpMockupSystem:
         }
         return prior_info
 
+    @serialized
     async def add_part(self, database_name, check_id_duplicates, check_fp_duplicates, part_id,
                        batch_id, part_type):
-        async with self.task_lock:
-            print(f"FPSystem-->add_part( {database_name}, {check_id_duplicates}, "
-                  f"{check_fp_duplicates}, {part_id}, {batch_id}, {part_type} )")
-
-            # Check system status.
-            if not (self.status.run_state == RunState.SYSTEM_READY
-                    and self.status.error_type == ErrorType.NO_ERROR):
-
-                print("FPSystem-->add_part not executed, system not ready or in error state. Call"
-                      " ResetSystem first.\n")
-                res = {
-                    'PartIDsOfDuplicates': "",
-                }
-                return res
-
-            # Acquire image - delay simulation.
-            self.status.update(RunState.ACQUIRING_IMAGE, ResultState.RESULT_UNDEFINED,
-                               ErrorType.NO_ERROR, 'add_part')
-            await asyncio.sleep(self.duration_estimations['add_part'] / 1000. * 0.4)  # 40%, seconds
-
-            # Compute the pseudo fingerprint.
-            self.status.update(RunState.COMMAND_RUNNING, ResultState.RESULT_UNDEFINED,
-                               ErrorType.NO_ERROR, 'add_part')
-            new_fingerprint = part_id.rjust(FINGERPRINT_SIZE // 3, '-') \
-                + batch_id.rjust(FINGERPRINT_SIZE // 3, '-') \
-                + part_type.rjust(FINGERPRINT_SIZE // 3 + FINGERPRINT_SIZE % 3, '-')
-
-            # If set, search for duplicates in all databases.
-            id_duplicates = []
-            fp_duplicates = []
-            for db in self.fp_databases.values():
-                for fp_entry in db:
-                    if check_id_duplicates and fp_entry.part_id == part_id:
-                        id_duplicates.append(fp_entry)
-                    if check_fp_duplicates and fp_entry.fingerprint == new_fingerprint:
-                        fp_duplicates.append(fp_entry)
-
-            await asyncio.sleep(self.duration_estimations['add_part'] / 1000. * 0.6)  # 60%, seconds
-
-            # If there are duplicates, do not add the new part to the database.
-            if len(id_duplicates) > 0:
-                print("The AddPart duplicate check found duplicates!")
-                self.status.update(RunState.SYSTEM_ERROR, ResultState.RESULT_READY,
-                                   ErrorType.ID_DUPLICATE_FOUND, '')
-                print("FPSystem-->add_part finished. (ID duplicate Error)\n")
-                res = {
-                    'PartIDsOfDuplicates': str([part.part_id for part in fp_duplicates].append(
-                        [part.part_id for part in id_duplicates])),
-                }
-                return res
-
-            if len(fp_duplicates) > 0:
-                print("The AddPart duplicate check found duplicates!")
-                self.status.update(RunState.SYSTEM_ERROR, ResultState.RESULT_READY,
-                                   ErrorType.FP_DUPLICATE_FOUND, '')
-                print("FPSystem-->add_part finished. (FP duplicate error)\n")
-                res = {
-                    'PartIDsOfDuplicates': str([part.part_id for part in fp_duplicates].append(
-                        [part.part_id for part in id_duplicates])),
-                }
-                return res
-
-            # If target database does not exist, simply create it. (In a real Fingerprint system,
-            # the database must exist, for example defined via ini file.)
-            try:
-                target_db = self.fp_databases[database_name]
-            except KeyError:
-                self.fp_databases[database_name] = set()
-                target_db = self.fp_databases[database_name]
-
-            # Finally add the fingerprint to the database.
-            target_db.add(FpDatabaseEntry(new_fingerprint, part_id, batch_id, part_type))
-
-            self.status.update(RunState.SYSTEM_READY, ResultState.RESULT_READY, ErrorType.NO_ERROR,
-                               '')
-            print("FP databases:\n ", "\n  ".join([f"{k}: {v}" for k, v in
-                  self.fp_databases.items()]))
-            print("FPSystem-->add_part finished. (Success)\n")
+        logger.debug("FPSystem-->add_part( %s, %s, %s, %s, %s, %s )", database_name,
+                     check_id_duplicates, check_fp_duplicates, part_id, batch_id, part_type)
+
+        # Check system status.
+        if not (self.status.run_state == RunState.SYSTEM_READY
+                and self.status.error_type == ErrorType.NO_ERROR):
+
+            logger.warning("FPSystem-->add_part not executed, system not ready or in error "
+                           "state. Call ResetSystem first.")
             res = {
                 'PartIDsOfDuplicates': "",
             }
             return res
 
-    def add_part_prior_info(self, *args):
-        prior_info = {
-            'ExpectedServiceExecutionDuration': self.duration_estimations['add_part'],  # ms
-            'ServiceTriggerResult': 1,            # 1=accepted
-            'ServiceResultMessage': "",
-            'ServiceResultCode': 0,
+        # Acquire image and compute - delay simulation.
+        self.status.update(RunState.ACQUIRING_IMAGE, ResultState.RESULT_UNDEFINED,
+                           ErrorType.NO_ERROR, 'add_part')
+        await self._simulate_duration(self._sleep_s['add_part'], 'add_part')
+
+        # Compute the pseudo fingerprint.
+        new_fingerprint = f"{part_id:->{_FP_PAD_ID}}{batch_id:->{_FP_PAD_BATCH}}" \
+                          f"{part_type:->{_FP_PAD_TYPE}}"
+
+        # If set, search for duplicates in all databases. An id duplicate fails the call anyway, so
+        # stop searching as soon as one is found (and, if checked, a fingerprint duplicate too).
+        id_duplicates = []
+        fp_duplicates = []
+        for db in self.fp_databases.values():
+            if check_id_duplicates and part_id in db.by_id:
+                id_duplicates.extend(db.by_id[part_id])
+            if check_fp_duplicates and new_fingerprint in db.by_fp:
+                fp_duplicates.extend(db.by_fp[new_fingerprint])
+            if id_duplicates and (fp_duplicates or not check_fp_duplicates):
+                break
+
+        # If there are duplicates, do not add the new part to the database. PartIDsOfDuplicates is
+        # a scalar String in the nodeset, so the ids are reported separated by ';'. An entry can be
+        # both an id and a fingerprint duplicate; each id is listed once, in order of discovery.
+        if len(id_duplicates) > 0:
+            logger.info("The AddPart duplicate check found duplicates!")
+            self.status.update(RunState.SYSTEM_ERROR, ResultState.RESULT_READY,
+                               ErrorType.ID_DUPLICATE_FOUND, '')
+            logger.debug("FPSystem-->add_part finished. (ID duplicate Error)")
+            res = {
+                'PartIDsOfDuplicates': ";".join(dict.fromkeys(
+                    part.part_id for part in itertools.chain(id_duplicates, fp_duplicates))),
+            }
+            return res
+
+        if len(fp_duplicates) > 0:
+            logger.info("The AddPart duplicate check found duplicates!")
+            self.status.update(RunState.SYSTEM_ERROR, ResultState.RESULT_READY,
+                               ErrorType.FP_DUPLICATE_FOUND, '')
+            logger.debug("FPSystem-->add_part finished. (FP duplicate error)")
+            res = {
+                'PartIDsOfDuplicates': ";".join(dict.fromkeys(
+                    part.part_id for part in itertools.chain(id_duplicates, fp_duplicates))),
+            }
+            return res
+
+        # If target database does not exist, simply create it. (In a real Fingerprint system,
+        # the database must exist, for example defined via ini file.)
+        target_db = self.fp_databases.get(database_name)
+        if target_db is None:
+            target_db = self.fp_databases[database_name] = FpDatabase()
+
+        # Finally add the fingerprint to the database.
+        target_db.add(FpDatabaseEntry(new_fingerprint, part_id, batch_id, part_type))
+
+        self.status.update(RunState.SYSTEM_READY, ResultState.RESULT_READY, ErrorType.NO_ERROR,
+                           '')
+        if logger.isEnabledFor(logging.DEBUG):     # dump of all databases is expensive
+            logger.debug("FP databases:\n  %s", "\n  ".join(f"{k}: {v}" for k, v in
+                                                          self.fp_databases.items()))
+        logger.debug("FPSystem-->add_part finished. (Success)")
+        res = {
+            'PartIDsOfDuplicates': "",
         }
-        return prior_info
+        return res
+
+    def add_part_prior_info(self, *args):
+        return self._prior_info_cache['add_part']
 
+    @serialized
     async def trace_part(self, database_name, ref_database_names, trace_all_databases, batch_ids,
                          trace_batchwise, part_types, trace_typewise):
-        async with self.task_lock:
-            print(f"FPSystem-->trace_part( {database_name}, {ref_database_names}, "
-                  f"{trace_all_databases}, {batch_ids}, {trace_batchwise}, {part_types}, "
-                  f"{trace_typewise} )")
-
-            # Check system status.
-            if not (self.status.run_state == RunState.SYSTEM_READY
-                    and self.status.error_type == ErrorType.NO_ERROR):
-                print("FPSystem-->trace_part not executed, system not ready or in error state. "
-                      "Call ResetSystem first.\n")
-                res = {
-                    'PartIDsOfDuplicates': "",
-                }
-                return res
-
-            # Acquire image delay simulation.
-            self.status.update(RunState.ACQUIRING_IMAGE, ResultState.RESULT_UNDEFINED,
-                               ErrorType.NO_ERROR, 'trace_part')
-            await asyncio.sleep(self.duration_estimations['trace_part'] / 1000 * 0.4)  # 40%, sec
-
-            # Convert the arguments ref_database_names, batch_ids and part_types, which are
-            # passed as a string of format "aaa;bb;cccc".
-            self.status.update(RunState.COMMAND_RUNNING, ResultState.RESULT_UNDEFINED,
-                               ErrorType.NO_ERROR, 'trace_part')
-            if len(batch_ids) != 0:
-                batch_id_list = batch_ids.split(';')
-            else:
-                batch_id_list = []
-            if len(part_types) != 0:
-                part_type_list = part_types.split(';')
-            else:
-                part_type_list = []
-            if len(ref_database_names) != 0:
-                ref_db_name_list = ref_database_names.split(';')
-            else:
-                ref_db_name_list = []
-
-            # Collect the databases to search in, keeping the assigned order.
-            if database_name not in ref_db_name_list:
-                ref_db_name_list.append(database_name)
-            if trace_all_databases:
-                for db_name in self.fp_databases.keys():
-                    if db_name not in ref_db_name_list:
-                        ref_db_name_list.append(db_name)
-
-            for ref_db_name in ref_db_name_list:
-                # Check if a datebase exists with the assigned name.
-                try:
-                    ref_db = self.fp_databases[ref_db_name]
-                except KeyError:
-                    if ref_db_name != database_name:  # database_name will be created if neccessary
-                        print(f"Database {ref_db_name} cannot be searched. It does not exist.")
-                    continue
-
-                # Ignore all database entries with non-fitting batch_id and/or part_type.
-                # Note!: The actual Fingerprint algorithm does not work this way, of course.
-                candidates = []
-                for fp_entry in ref_db:
-                    if not ((trace_batchwise and fp_entry.batch_id not in batch_id_list) or
-                            (trace_typewise and fp_entry.part_type not in part_type_list)):
-                        candidates.append(fp_entry)
-                if len(candidates) > 0:
-                    x = randint(0, len(candidates) - 1)
-                    fp_entry = candidates[x]
-                    break
-            else:
-                # In none of the visited databases a fitting Fingerprint entry has been found.
-                await asyncio.sleep(self.duration_estimations['trace_part'] / 1000 * 0.6)  # 60%,sec
-                self.status.update(RunState.SYSTEM_READY, ResultState.RESULT_READY,
-                                   ErrorType.NO_ERROR, '')
-
-                print("FPSystem-->trace_part finished. (No part found)\n")
-                res = {
-                    'ServiceExecutionResult': 0,    # 0=success
-                    'PartID': "",
-                    'BatchID': "",
-                    'PartType': "",
-                    'CurrentConfidenceValue1': 0,
-                    'CurrentConfidenceValue2': 0,
-                    'AverageConfidenceValue1': 0,
-                    'AverageConfidenceValue2': 0,
-                }
-                return res
-
-            # A fitting Fingerprint entry has been found. Move it to the target database.
-            # If target database does not exist, simply create it. (In a real Fingerprint system,
-            # the database must exist, for example defined via ini file.)
-            print(f"TracePart found part entry {fp_entry} in database '{ref_db_name}'!")
-            ref_db.remove(fp_entry)
-            try:
-                self.fp_databases[database_name].add(fp_entry)
-            except KeyError:
-                self.fp_databases[database_name] = set()
-                self.fp_databases[database_name].add(fp_entry)
-                print(f"Found part entry was moved to newly created target database "
-                      f"{database_name}. Previously the database did not exist.")
-
-            await asyncio.sleep(self.duration_estimations['trace_part'] / 1000 * 0.6)  # 60%, sec
-
-            self.status.update(RunState.SYSTEM_READY, ResultState.RESULT_READY, ErrorType.NO_ERROR,
-                               '')
-            print("FPSystem-->trace_part finished. (Part found)\n")
+        logger.debug("FPSystem-->trace_part( %s, %s, %s, %s, %s, %s, %s )", database_name,
+                     ref_database_names, trace_all_databases, batch_ids, trace_batchwise,
+                     part_types, trace_typewise)
+
+        # Check system status.
+        if not (self.status.run_state == RunState.SYSTEM_READY
+                and self.status.error_type == ErrorType.NO_ERROR):
+            logger.warning("FPSystem-->trace_part not executed, system not ready or in error "
+                           "state. Call ResetSystem first.")
+            res = {
+                'PartIDsOfDuplicates': "",
+            }
+            return res
+
+        # Acquire image and compute - delay simulation.
+        self.status.update(RunState.ACQUIRING_IMAGE, ResultState.RESULT_UNDEFINED,
+                           ErrorType.NO_ERROR, 'trace_part')
+        await self._simulate_duration(self._sleep_s['trace_part'], 'trace_part')
+
+        # Convert the arguments ref_database_names, batch_ids and part_types, which are
+        # passed as a string of format "aaa;bb;cccc".
+        # Batch ids and part types are only used as (unordered) filters.
+        batch_id_set = frozenset(batch_ids.split(';')) if batch_ids else frozenset()
+        part_type_set = frozenset(part_types.split(';')) if part_types else frozenset()
+        if len(ref_database_names) != 0:
+            ref_db_name_list = ref_database_names.split(';')
+        else:
+            ref_db_name_list = []
+
+        # Collect the databases to search in, keeping the assigned order.
+        ref_db_names_seen = set(ref_db_name_list)
+        if database_name not in ref_db_names_seen:
+            ref_db_name_list.append(database_name)
+            ref_db_names_seen.add(database_name)
+        if trace_all_databases:
+            for db_name in self.fp_databases.keys():
+                if db_name not in ref_db_names_seen:
+                    ref_db_name_list.append(db_name)
+                    ref_db_names_seen.add(db_name)
+
+        for ref_db_name in ref_db_name_list:
+            # Check if a datebase exists with the assigned name.
+            ref_db = self.fp_databases.get(ref_db_name)
+            if ref_db is None:
+                if ref_db_name != database_name:  # database_name will be created if neccessary
+                    logger.warning("Database %s cannot be searched. It does not exist.",
+                                   ref_db_name)
+                continue
+
+            # Ignore all database entries with non-fitting batch_id and/or part_type.
+            # Note!: The actual Fingerprint algorithm does not work this way, of course.
+            candidates = tuple(ref_db.select(batch_id_set if trace_batchwise else None,
+                                             part_type_set if trace_typewise else None))
+            if len(candidates) > 0:
+                fp_entry = choice(candidates)
+                break
+        else:
+            # In none of the visited databases a fitting Fingerprint entry has been found.
+            self.status.update(RunState.SYSTEM_READY, ResultState.RESULT_READY,
+                               ErrorType.NO_ERROR, '')
+
+            logger.debug("FPSystem-->trace_part finished. (No part found)")
             res = {
                 'ServiceExecutionResult': 0,    # 0=success
-                'PartID': fp_entry.part_id,
-                'BatchID': fp_entry.batch_id,
-                'PartType': fp_entry.part_type,
-                'CurrentConfidenceValue1': 99,
-                'CurrentConfidenceValue2': 100,
-                'AverageConfidenceValue1': 97,
-                'AverageConfidenceValue2': 98,
+                'PartID': "",
+                'BatchID': "",
+                'PartType': "",
+                'CurrentConfidenceValue1': 0,
+                'CurrentConfidenceValue2': 0,
+                'AverageConfidenceValue1': 0,
+                'AverageConfidenceValue2': 0,
             }
             return res
 
-    def trace_part_prior_info(self, *args):
-        prior_info = {
-            'ExpectedServiceExecutionDuration': self.duration_estimations['trace_part'],  # ms
-            'ServiceTriggerResult': 1,            # 1=accepted
-            'ServiceResultMessage': "",
-            'ServiceResultCode': 0,
+        # A fitting Fingerprint entry has been found. Move it to the target database.
+        # If target database does not exist, simply create it. (In a real Fingerprint system,
+        # the database must exist, for example defined via ini file.)
+        logger.debug("TracePart found part entry %s in database '%s'!", fp_entry, ref_db_name)
+        ref_db.remove(fp_entry)
+        target_db = self.fp_databases.get(database_name)
+        if target_db is None:
+            target_db = self.fp_databases[database_name] = FpDatabase()
+            logger.info("Found part entry was moved to newly created target database %s. "
+                        "Previously the database did not exist.", database_name)
+        target_db.add(fp_entry)
+
+        self.status.update(RunState.SYSTEM_READY, ResultState.RESULT_READY, ErrorType.NO_ERROR,
+                           '')
+        logger.debug("FPSystem-->trace_part finished. (Part found)")
+        res = {
+            'ServiceExecutionResult': 0,    # 0=success
+            'PartID': fp_entry.part_id,
+            'BatchID': fp_entry.batch_id,
+            'PartType': fp_entry.part_type,
+            'CurrentConfidenceValue1': 99,
+            'CurrentConfidenceValue2': 100,
+            'AverageConfidenceValue1': 97,
+            'AverageConfidenceValue2': 98,
         }
-        return prior_info
+        return res
+
+    def trace_part_prior_info(self, *args):
+        return self._prior_info_cache['trace_part']
@@ -15,15 +15,62 @@ __version__ = 1.00
 
 import asyncio
 from asyncua import Server, ua, uamethod
-from configparser import ConfigParser
+from dataclasses import dataclass
 from enum import Enum
+from functools import lru_cache
 import logging
 from pathlib import Path
+import re
+from typing import Callable, Optional
 
 
+# The opcua interface logs on its own handler, independent of the root logger's level.
+logger = logging.getLogger('fp_opcua')
+logger.addHandler(logging.StreamHandler())
+logger.setLevel(logging.INFO)     # logging.DEBUG for debugging
+logger.propagate = False
+
 CURR_FILE_PATH = Path(__file__).parent
 OPCUA_CONFIG_PATH = CURR_FILE_PATH / 'fp_opcua.ini'
 
+_CAMEL_RE = re.compile(r'(?<!^)(?=[A-Z])')   # positions in front of inner uppercase letters
+# Strings accepted by float(), matched without raising an exception.
+_DIGITS = r'\d(?:_?\d)*'
+_FLOAT_RE = re.compile(rf'\s*[+-]?(?:(?:{_DIGITS}(?:\.(?:{_DIGITS})?)?|\.{_DIGITS})'
+                       rf'(?:[eE][+-]?{_DIGITS})?|inf|infinity|nan)\s*', re.IGNORECASE)
+
+
+# One line of the INI config file: blank or comment, [section] header, 'key=value' or
+# 'key: value' option, indented continuation of the previous option's value, or anything else
+# (unparsable). No part of a match spans more than one line.
+_INI_RE = re.compile(r"""^(?:
+    [ \t]*(?:[#;][^\n]*)?
+  | \[(?P<section>[^\]\n]+)\][ \t]*
+  | (?P<key>[^\s;#\[][^=:\n]*?)[ \t]*[=:][ \t]*(?P<val>[^\n]*?)[ \t]*
+  | [ \t]+(?P<cont>[^\n]*?)[ \t]*
+  | (?P<bad>[^\n]+)
+)$""", re.MULTILINE | re.VERBOSE)
+
+
+# Variant types of the 'state' variables that are updated from the FpSystem status.
+STATE_VARIANT_TYPES = {
+    'RunState': ua.VariantType.SByte,
+    'ResultState': ua.VariantType.SByte,
+    'ErrorType': ua.VariantType.SByte,
+    'CurrentCommand': ua.VariantType.String,
+}
+
+
+@dataclass
+class Service:
+    """An opcua SWAP-IT service and the FpSystem functionality it is linked to."""
+    name: str
+    func: Callable
+    prior_info_func: Optional[Callable]
+    result_datatype: type
+    returns_async: bool
+    event_triggering_func: Optional[Callable] = None    # set for async services only.
+
 
 class ConfigSection(Enum):
     DESCR = 'DESCRIPTION'
@@ -33,16 +80,60 @@ class ConfigSection(Enum):
     STATE = 'STATE'
 
 
+@lru_cache(maxsize=None)
 def camel_to_snake(s):
     """Converts CamelCase to snake_case (without additional lib)."""
-    return ''.join(['_' + c.lower() if c.isupper() else c for c in s]).lstrip('_')
+    return _CAMEL_RE.sub('_', s).lower()
 
 
+@lru_cache(maxsize=None)
 def snake_to_camel(s):
     """Converts snake_case to CamelCase (without additional lib)."""
     return ''.join(part.capitalize() for part in s.split('_'))
 
 
+def classify_config_value(s):
+    """Return the python type and the matching opcua type for the config string s: int for
+        decimals, bool for 'true'/'false', float for anything float() accepts, else str."""
+    if s.isdecimal():
+        return int, ua.uatypes.Int16
+    if s.lower() in ('false', 'true'):
+        return bool, ua.uatypes.Boolean
+    if _FLOAT_RE.fullmatch(s):
+        return float, ua.uatypes.Float
+    return str, ua.uatypes.String
+
+
+def parse_ini(text):
+    """Parse the INI formatted text into a dict {section: {key: raw value}}. Lines that cannot be
+        parsed, including options in front of the first section header, are logged and skipped."""
+    config = {}
+    options = None
+    key = None      # last option, continuation lines are appended to its value.
+    for m in _INI_RE.finditer(text):
+        section, new_key, val, cont, bad = m.group('section', 'key', 'val', 'cont', 'bad')
+        if section is not None:
+            options = config.setdefault(section.strip(), {})
+            key = None
+        elif new_key is not None and options is not None:
+            key = new_key
+            options[key] = val
+        elif cont is not None and key is not None:
+            options[key] = f"{options[key]}\n{cont}"
+        elif new_key is not None or cont is not None or bad is not None:
+            logger.warning("WARN: Config line %d cannot be parsed and is ignored: %r",
+                           text.count('\n', 0, m.start()) + 1, m.group())
+    return config
+
+
+@lru_cache(maxsize=256)
+def state_data_value(val, variant_type):
+    """Return a DataValue for a 'state' variable value. State values come from a small set
+        (enum values, command names), and asyncua's DataValue and Variant are immutable, so the
+        instances are shared instead of being rebuilt for every write."""
+    return ua.DataValue(ua.Variant(val, variant_type))
+
+
 def dict_to_attribs(self, dict_, obj):
     """Write each dict_ item as attribute to obj."""
     for name, val in dict_:
@@ -53,14 +144,6 @@ def dict_to_attribs(self, dict_, obj):
 class FpOpcuaServer:
     def __init__(self):
         """Create a quite empty FpOpcuaServer instance."""
-        # Enable logging.
-        global FpOpcuaLogger
-        # logging.basicConfig(level=logging.DEBUG)
-        FpOpcuaLogger = logging.Logger('fp_opcua')
-        my_handler = logging.StreamHandler()
-        FpOpcuaLogger.addHandler(my_handler)
-        FpOpcuaLogger.setLevel(logging.INFO)
-
         # Create plain OpcUa server.
         self.server = None
 
@@ -68,18 +151,38 @@ class FpOpcuaServer:
         self.variables = {}         # storage for capability and property nodes.
         self.event_gens = {}        # storage for prepared events that can then be easily used.
         self.tasks_running = set()  # prevent early garbage collection of concurrent tasks.
+        self._discard_task = self.tasks_running.discard   # bound once, see spawn_task().
+        self._last_state = {}       # last values written to the 'state' variables.
+        self._state_meta = {}       # {state var name: (nodeid, VariantType)} for update_state().
+        self._poll_now = asyncio.Event()  # wakes periodic_state_update() up early.
+        self._services_running = 0  # async service calls in progress.
 
         self.fp_system = None
-
-    @staticmethod
-    async def read_config(path):
-        """Read in the config file at 'path' and return the ConfigParser object."""
-        config = ConfigParser()
-        config.optionxform = str    # disable preprocessing to lowercase
-        visited = config.read(path)
-        if len(visited) == 0:
-            FpOpcuaLogger.error("ERROR: Reading config file failed!")
-        return config
+        self._config = None         # parsed config file, see read_config().
+        self.config = {}            # the config used by the server, set in set_up_server().
+        self._cfg_ci = {}           # the config, with sections looked up by uppercase name.
+
+    def read_config(self, path):
+        """Read in the config file at 'path' and return it as dict {section: {key: raw value}}.
+            The file is parsed on the first call only; later calls return the same dict."""
+        if self._config is None:
+            try:
+                text = Path(path).read_text(encoding='utf-8')
+            except OSError:
+                logger.error("ERROR: Reading config file failed!")
+                text = ''
+            self._config = parse_ini(text)
+            # Index of the uppercase and capitalized sections by uppercase name. Options of an
+            # uppercase section take precedence.
+            self._cfg_ci = {}
+            for section, options in self._config.items():
+                merged = self._cfg_ci.setdefault(section.upper(), {})
+                if section == section.upper():
+                    merged.update(options)
+                elif section == section.capitalize():
+                    for key, val in options.items():
+                        merged.setdefault(key, val)
+        return self._config
 
     async def set_up_server(self):
         """Create and initialize the asyncua OPCUA server component."""
@@ -87,12 +190,15 @@ class FpOpcuaServer:
         await self.server.init()
         # self.server.disable_clock()  # For debugging
 
-        # Read and set general server settings from config.
-        config = await self.read_config(OPCUA_CONFIG_PATH)
-        server_name = config.get(ConfigSection.DESCR.value, 'server_name', fallback='unnamed')
-        opcua_host = config.get(ConfigSection.DESCR.value, 'opcua_host', fallback='127.0.0.1')
-        opcua_port = config.getint(ConfigSection.DESCR.value, 'opcua_port', fallback=4840)
-        app_uri = config.get(ConfigSection.DESCR.value, 'app_uri')
+        # Read the config once; the later initialization steps use self.config.
+        self.config = self.read_config(OPCUA_CONFIG_PATH)
+
+        # Set general server settings from config.
+        descr = self.config.get(ConfigSection.DESCR.value, {})
+        server_name = descr.get('server_name', 'unnamed')
+        opcua_host = descr.get('opcua_host', '127.0.0.1')
+        opcua_port = int(descr.get('opcua_port', 4840))
+        app_uri = descr['app_uri']
 
         self.server.set_endpoint(f'opc.tcp://{opcua_host}:{opcua_port}/freeopcua/server/')
         self.server.set_server_name(server_name)
@@ -109,19 +215,18 @@ class FpOpcuaServer:
         objects = self.server.get_objects_node()
 
         # Load server nodeset: Import the nodes from the xml files defined in the config.
-        config = await self.read_config(OPCUA_CONFIG_PATH)
-        for nodeset_name, nodeset_path in config.items(ConfigSection.NODES.value):
+        for nodeset_name, nodeset_path in self.config[ConfigSection.NODES.value].items():
             p = CURR_FILE_PATH/Path(nodeset_path)
             _ = await self.server.import_xml(p.absolute())
-            FpOpcuaLogger.debug(f'DEBUG: Loaded nodeset "{nodeset_name}": {_}.')
+            logger.debug('DEBUG: Loaded nodeset "%s": %s.', nodeset_name, _)
 
         # Get correct namespace indices.
         namespaces = await self.server.get_namespace_array()
-        FpOpcuaLogger.info(f"INFO: Loaded namespaces: {namespaces}.")
+        logger.info("INFO: Loaded namespaces: %s.", namespaces)
         self.idx_swap = namespaces.index("http://common.swap.fraunhofer.de")
         self.idx_fp = namespaces.index("http://fingerprint.swap.ipm.fraunhofer.de")
         self.loaded_type_definitions = await self.server.load_data_type_definitions()
-        FpOpcuaLogger.debug(f"DEBUG: Loaded data type definitions: {self.loaded_type_definitions}.")
+        logger.debug("DEBUG: Loaded data type definitions: %s.", self.loaded_type_definitions)
 
         # Get the type node FingerprintModule and create an instance.
         root = self.server.get_root_node()
@@ -145,76 +250,67 @@ class FpOpcuaServer:
     async def init_variables(self):
         """Initialize all opcua interface SWAP-IT variables (= in 'Capabilities', 'Properties',
             'State') from config file."""
-        config = await self.read_config(OPCUA_CONFIG_PATH)
 
         # todo: moved 'state' var outside. Apply "init_variable" here too, then re-merge.
         for container_name in ('Capabilities', 'Properties'):
             var_container = await self.FingerprintModuleObj.get_child(f"{self.idx_swap}:"
                                                                       f"{container_name}")
-            for var_node in await var_container.get_variables():
-                # All variables of 'Capabilities', 'Properties' and 'State' shall be read-only
-                # for clients.
-                await var_node.set_read_only()
-
-                # Init type and value.
-                try:
-                    await self.init_variable(container_name, var_node, config)
-                except ua.UaError as e:
-                    FpOpcuaLogger.error(f"Error: Could not initialize {container_name}-{var_node}"
-                                        f": {e}")
+            var_nodes = await var_container.get_variables()
+            # All variables of 'Capabilities', 'Properties' and 'State' shall be read-only for
+            # clients. Issue the node requests concurrently.
+            await asyncio.gather(*(var_node.set_read_only() for var_node in var_nodes))
+            browse_names = await asyncio.gather(*(var_node.read_browse_name()
+                                                  for var_node in var_nodes))
+            # Init type and value. The value writes of a container are issued together.
+            results = await asyncio.gather(
+                *(self.init_variable(container_name, var_node, browse_name.Name)
+                  for var_node, browse_name in zip(var_nodes, browse_names)),
+                return_exceptions=True)
+            for var_node, e in zip(var_nodes, results):
+                if isinstance(e, ua.UaError):
+                    logger.error("Error: Could not initialize %s-%s: %s", container_name, var_node,
+                                 e)
                     return
+                if isinstance(e, BaseException):
+                    raise e
 
         # todo: temporary separation. see todo above (re-merge).
         for container_name in ('State',):
             var_container = await self.FingerprintModuleObj.get_child(f"{self.idx_swap}:"
                                                                       f"{container_name}")
-            for var_node in await var_container.get_variables():
-                await var_node.set_read_only()
-
-                # Init value.
-                var_name = (await var_node.read_browse_name()).Name
+            var_nodes = await var_container.get_variables()
+            await asyncio.gather(*(var_node.set_read_only() for var_node in var_nodes))
+            browse_names = await asyncio.gather(*(var_node.read_browse_name()
+                                                  for var_node in var_nodes))
+            # Init values, all with a single state update.
+            init_state = {}
+            for var_node, browse_name in zip(var_nodes, browse_names):
+                var_name = browse_name.Name
                 self.variables[var_name] = var_node
-                val = config.get(ConfigSection.STATE.value, var_name)
-                await self.update_state({var_name: val})
+                if var_name in STATE_VARIANT_TYPES:
+                    self._state_meta[var_name] = (var_node.nodeid, STATE_VARIANT_TYPES[var_name])
+                init_state[var_name] = self.config[ConfigSection.STATE.value][var_name]
+            await self.update_state(init_state)
         return
 
-    async def init_variable(self, container_name, var_node, config):
+    async def init_variable(self, container_name, var_node, var_name):
         """Set the variable's initial value and use the initial type to define the type in
-            general. Also set the access rights (for clients). """
-        var_name = (await var_node.read_browse_name()).Name
-
+            general. The access rights (for clients) are set by init_variables. """
         # Make node directly accessible via dict.
         self.variables[var_name] = var_node
 
         # Search for a config val, uppercase and capitalized. Get it as string.
-        init_val = config.get(container_name.upper(), var_name, fallback=None)    # set raw=True?
+        init_val = self._cfg_ci.get(container_name.upper(), {}).get(var_name)
         if init_val is None:
-            init_val = config.get(container_name.capitalize(), var_name, fallback=None)
-            if init_val is None:
-                FpOpcuaLogger.warning(f"WARN: No entry in config file to initialize "
-                                      f"{container_name}-{var_name}.")
-                return
+            logger.warning("WARN: No entry in config file to initialize %s-%s.", container_name,
+                           var_name)
+            return
 
         # todo: Reverse: Look up type of variable in xml definition, then try suitable conversion.
         # Convert init value: string to correct type.
         # handle decimal, float, boolean, none, string; scalars and 1d arrays
         val_array = init_val.split(',')
-
-        if val_array[0].isdecimal():
-            type_ = int
-            ua_type = ua.uatypes.Int16
-        elif val_array[0].lower() in ('false', 'true'):
-            type_ = bool
-            ua_type = ua.uatypes.Boolean
-        else:
-            try:
-                float(val_array[0])
-            except ValueError:
-                type_ = str
-                ua_type = ua.uatypes.String
-            else:
-                type_ = float
-                ua_type = ua.uatypes.Float
+        type_, ua_type = classify_config_value(val_array[0])
 
         if len(val_array) > 1:
             vals_typed = [type_(v.strip('"')) for v in val_array]
@@ -224,17 +320,17 @@ class FpOpcuaServer:
             vals_typed = type_(val_array[0].strip('"'))
             dims = None
             ua_variant = ua.Variant(vals_typed, ua_type)
-        FpOpcuaLogger.debug(f"DEBUG: {vals_typed} | {dims} dim | {ua_type}.")
+        logger.debug("DEBUG: %s | %s dim | %s.", vals_typed, dims, ua_type)
 
         # Set attribute node to typed initial value; with type and dimensions handed on.
-        FpOpcuaLogger.info(f"INFO: Initializing {container_name}-{var_name} to '{vals_typed}'...")
+        logger.info("INFO: Initializing %s-%s to '%s'...", container_name, var_name, vals_typed)
         try:
             ua_val = ua.DataValue(ua_variant)
             await self.server.write_attribute_value(var_node.nodeid, ua_val)
 #            await self.server.write_attribute_value(var_node.nodeid, ua.DataValue(vals_typed))
         except ua.UaError:
-            FpOpcuaLogger.warning(f"WARN: Initializing {container_name}-{var_name} -/-> "
-                                  f"{vals_typed} failed!")
+            logger.warning("WARN: Initializing %s-%s -/-> %s failed!", container_name, var_name,
+                           vals_typed)
 
     async def link_services(self):
         """Link all services (nodes) to methods of the same name but snake case and prefixed with
@@ -244,41 +340,43 @@ class FpOpcuaServer:
         """
         # From the loaded opcua interface, get the nodes of the SWAP-IT services, the sync and
         # async result data types, and service finished event types; for the next steps.
-        services_node = await self.FingerprintModuleObj.get_child(f'{self.idx_swap}:Services')
+        # The lookups are independent, so issue them concurrently. The sync and async result types
+        # share their path up to the common result type, which is resolved only once.
         root = self.server.get_root_node()
-        sync_result_type = await root.get_child(
-            [
+        services_node, base_result_type, s_f_event_type = await asyncio.gather(
+            self.FingerprintModuleObj.get_child(f'{self.idx_swap}:Services'),
+            root.get_child([
                 "0:Types",
                 "0:DataTypes",
                 "0:BaseDataType",
                 "0:Structure",
                 f"{self.idx_swap}:ServiceExecutionResultDataType",
-                f"{self.idx_swap}:ServiceExecutionSyncResultDataType",
-            ]
-        )
-        async_result_type = await root.get_child(
-            [
-                "0:Types",
-                "0:DataTypes",
-                "0:BaseDataType",
-                "0:Structure",
-                f"{self.idx_swap}:ServiceExecutionResultDataType",
-                f"{self.idx_swap}:ServiceExecutionAsyncResultDataType",
-            ]
-        )
-        s_f_event_type = await root.get_child(
-            [
+            ]),
+            root.get_child([
                 "0:Types",
                 "0:EventTypes",
                 "0:BaseEventType",
                 f"{self.idx_swap}:ServiceFinishedEventType",
-            ]
+            ]),
+        )
+        sync_result_type, async_result_type = await asyncio.gather(
+            base_result_type.get_child(f"{self.idx_swap}:ServiceExecutionSyncResultDataType"),
+            base_result_type.get_child(f"{self.idx_swap}:ServiceExecutionAsyncResultDataType"),
         )
 
+        # All services that return delayed use the same async result type; look it up only once.
+        async_result_type_name = (await async_result_type.read_browse_name()).Name
+        async_result_cls = self.loaded_type_definitions.get(async_result_type_name)
+
+        # Names of all FpSystem attributes, to find the methods to connect to.
+        fp_system_attribs = set(dir(self.fp_system))
+
         # Loop over the services.
         service_nodes = await services_node.get_methods()
-        for service_node in service_nodes:
-            service_name = (await service_node.read_browse_name()).Name
+        browse_names = await asyncio.gather(*(service_node.read_browse_name()
+                                              for service_node in service_nodes))
+        for service_node, browse_name in zip(service_nodes, browse_names):
+            service_name = browse_name.Name
 
             # Ignore services handled by the SWAP-IT architecture.
             if service_name in ('register', 'unregister'):
@@ -286,35 +384,39 @@ class FpOpcuaServer:
 
             # Get the FpSystem's functionality methods to connect to.
             fp_system_method_name = camel_to_snake(service_name)
-            try:
-                fp_system_func = getattr(self.fp_system, fp_system_method_name)
-            except AttributeError:
-                FpOpcuaLogger.error(f"ERROR: No method {fp_system_method_name} found for service "
-                                    f"{service_name}.")
+            if fp_system_method_name not in fp_system_attribs:
+                logger.error("ERROR: No method %s found for service %s.", fp_system_method_name,
+                             service_name)
                 continue
-            fp_system_prior_info_func = getattr(self.fp_system,
-                                                f'{fp_system_method_name}_prior_info', None)
+            fp_system_func = getattr(self.fp_system, fp_system_method_name)
+            fp_system_prior_info_name = f'{fp_system_method_name}_prior_info'
+            if fp_system_prior_info_name in fp_system_attribs:
+                fp_system_prior_info_func = getattr(self.fp_system, fp_system_prior_info_name)
+            else:
+                fp_system_prior_info_func = None
 
             # Find out if the service is defined to return immediately (sync) or delayed (async &
             # event). A corresponding sync result data type or a service finished event type
-            # reveals this.
-            try:
-                service_event_type = await s_f_event_type.get_child(
-                    f"{self.idx_fp}:{service_name}ServiceFinishedEventType",
-                )
+            # reveals this. Probe both concurrently.
+            service_event_type, service_result_type = await asyncio.gather(
+                s_f_event_type.get_child(f"{self.idx_fp}:{service_name}ServiceFinishedEventType"),
+                sync_result_type.get_child(
+                    f"{self.idx_fp}:{service_name}ServiceExecutionSyncResultDataType"),
+                return_exceptions=True,
+            )
+            for probe in (service_event_type, service_result_type):
+                if isinstance(probe, BaseException) and not isinstance(probe, ua.UaError):
+                    raise probe
+            if not isinstance(service_event_type, ua.UaError):
                 returns_async = True
-            except ua.UaError:
-                try:
-                    service_result_type = await sync_result_type.get_child(
-                        f"{self.idx_fp}:{service_name}ServiceExecutionSyncResultDataType",
-                    )
-                    returns_async = False
-                except ua.UaError as e:
-                    FpOpcuaLogger.error(f"ERROR: Service {service_name} could not be linked since"
-                                        f" neither EventType '{service_name}"
-                                        f"ServiceFinishedEventType' nor DataType '{service_name}"
-                                        f"ServiceExecutionSyncResultDataType' exists: {e}")
-                    continue
+            elif not isinstance(service_result_type, ua.UaError):
+                returns_async = False
+            else:
+                logger.error("ERROR: Service %s could not be linked since neither EventType "
+                             "'%sServiceFinishedEventType' nor DataType "
+                             "'%sServiceExecutionSyncResultDataType' exists: %s", service_name,
+                             service_name, service_name, service_result_type)
+                continue
 
             if returns_async:
                 # Get the event generator for the service that returns delayed. Set it to create
@@ -323,28 +425,25 @@ class FpOpcuaServer:
                     service_event_type, self.FingerprintModuleObj)
 
                 # All services that return delayed use the same async result type.
-                async_result_type_name = (await async_result_type.read_browse_name()).Name
-                try:
-                    result_type = self.loaded_type_definitions[async_result_type_name]
-                    # print( type(async_result_type), type(result_type) )
-                except KeyError:
-                    FpOpcuaLogger.error(f"ERROR: General DataType {async_result_type} not found "
-                                        f"for async service {service_name} in "
-                                        f"{self.loaded_type_definitions}.")
+                if async_result_cls is None:
+                    logger.error("ERROR: General DataType %s not found for async service %s in "
+                                 "%s.", async_result_type, service_name,
+                                 self.loaded_type_definitions)
                     continue
+                result_type = async_result_cls
             else:
                 # All services that return immediately use their own sync result type.
-                # FpOpcuaLogger.debug("Debug:", await self.server.load_data_type_definitions(
+                # logger.debug("Debug:", await self.server.load_data_type_definitions(
                 #    node=sync_result_type))
                 service_result_type_name = (await service_result_type.read_browse_name()).Name
                 try:
                     result_type = self.loaded_type_definitions[service_result_type_name]
                 except KeyError:
-                    FpOpcuaLogger.warning(f"WARN: Specific DataType {service_result_type_name} "
-                                          f"not found for sync service {service_name}.")
-                    # FpOpcuaLogger.error(f"ERROR: Specific DataType {service_result_type_name} "
-                    #                     f"not found for sync service {service_name} in "
-                    #                     f"{self.loaded_type_definitions}.")  #todo disabled
+                    logger.warning("WARN: Specific DataType %s not found for sync service %s.",
+                                   service_result_type_name, service_name)
+                    # logger.error("ERROR: Specific DataType %s not found for sync service %s in "
+                    #              "%s.", service_result_type_name, service_name,
+                    #              self.loaded_type_definitions)  #todo disabled
                     continue
 
             # Wrap the non-opcua fp system's func to make it return sync or async.
@@ -358,124 +457,163 @@ class FpOpcuaServer:
             try:
                 self.server.link_method(service_node, backend_method)
             except (AttributeError, ua.UaError) as e:
-                FpOpcuaLogger.error(f"ERROR: Could not link {service_name} to self."
-                                    f"{backend_method_name}: {e}")
+                logger.error("ERROR: Could not link %s to self.%s: %s", service_name,
+                             backend_method_name, e)
                 return
-            FpOpcuaLogger.info(f"INFO: Linked service {service_name} to self.{backend_method_name} "
-                               f"with core functionality {fp_system_func.__qualname__}.")
+            logger.info("INFO: Linked service %s to self.%s with core functionality %s.",
+                        service_name, backend_method_name, fp_system_func.__qualname__)
 
         return
 
     async def make_it_service_responding(self, service_name, func, func_prior_info,
                                          immediate_result_datatype, returns_async):
         """Wrap func so it can be linked to an opcua SWAP-IT service."""
+        service = Service(service_name, func, func_prior_info, immediate_result_datatype,
+                          returns_async)
         if returns_async:
-            @uamethod
-            async def service_responding_func(node_id, *input_args):
-                """When linked to a service of the opcua interface, a call to the service will call
-                    the func with parameters node_id and a list of inputs arguments."""
-                FpOpcuaLogger.info(f"INFO: Service {service_name} request received. Returns "
-                                   f"async: {returns_async}. Input args: {input_args}.")
-
-                # Get prior info.
-                if func_prior_info is None:
-                    FpOpcuaLogger.warning("WARN: No method '[func]_prior_info' found for service"
-                                          f" '{service_name}'.")
-                    prior_info = {
-                        'ExpectedServiceExecutionDuration': -1.0,
-                        'ServiceTriggerResult': 1,
-                        'ServiceResultMessage': "",
-                        'ServiceResultCode': 1,
-                    }
-                else:
-                    prior_info = dict(func_prior_info(*input_args))
-
-                # For a delayed returning func, make it event triggering and call it in a new
-                # thread.
-                event_gen = self.event_gens[service_name]
-                event_triggering_func = await self.make_it_event_triggering(func, event_gen)
-                event_loop = asyncio.get_event_loop()
-                task = event_loop.create_task(event_triggering_func(*input_args))
-                self.tasks_running.add(task)
-                task.add_done_callback(self.tasks_running.discard)
-                await self.update_state(await self.fp_system._get_status())
-
-                # Immedately return the prior info (without waiting for the thread).
-                immediate_result = immediate_result_datatype(**prior_info)
-                return ua.Variant(immediate_result, ua.VariantType.ExtensionObject)
-            return service_responding_func
-
-        else:
-            @uamethod
-            async def service_responding_func(node_id, *input_args):
-                """When linked to a service of the opcua interface, a call to the service will call
-                    the func with parameters node_id and a list of inputs arguments."""
-                FpOpcuaLogger.info(f"INFO: Service {service_name} request received. Returns "
-                                   f"async: {returns_async}. Input args: {input_args}.")
-
-                # Get prior info.
-                if func_prior_info is None:
-                    FpOpcuaLogger.warning(f"WARN: No method '[func]_prior_info' found for service"
-                                          f" '{service_name}'.")
-                    prior_info = {}
-                else:
-                    prior_info = dict(func_prior_info(*input_args))
-
-                # Call the sync returning func.
-                sync_results = func(*input_args)
-                prior_info.update(**sync_results)
-                await self.update_state(await self.fp_system._get_status())
-                immediate_result = immediate_result_datatype(**sync_results)
-                return ua.Variant(immediate_result, ua.VariantType.ExtensionObject)
-            return service_responding_func
+            # For a delayed returning func, make it event triggering.
+            service.event_triggering_func = await self.make_it_event_triggering(
+                func, self.event_gens[service_name])
+        respond = self._respond_async if returns_async else self._respond_sync
+
+        @uamethod
+        async def service_responding_func(node_id, *input_args):
+            """When linked to a service of the opcua interface, a call to the service will call
+                the func with parameters node_id and a list of inputs arguments."""
+            return await respond(service, *input_args)
+        return service_responding_func
+
+    def _get_prior_info(self, service, input_args, default):
+        """Return a mutable copy of the service's prior info, or default if it has none."""
+        if service.prior_info_func is None:
+            logger.warning("WARN: No method '[func]_prior_info' found for service '%s'.",
+                           service.name)
+            return default
+        return dict(service.prior_info_func(*input_args))
+
+    async def _respond_async(self, service, *input_args):
+        """Respond to a call of a delayed returning service: start the func in a new task and
+            immediately return the prior info."""
+        logger.info("INFO: Service %s request received. Returns async: %s. Input args: %s.",
+                    service.name, service.returns_async, input_args)
+        prior_info = self._get_prior_info(service, input_args, {
+            'ExpectedServiceExecutionDuration': -1.0,
+            'ServiceTriggerResult': 1,
+            'ServiceResultMessage': "",
+            'ServiceResultCode': 1,
+        })
+
+        # Call the event triggering func in a new task, so services can run concurrently.
+        self.spawn_task(service.event_triggering_func(*input_args), name=service.name)
+        await self.update_state(await self.fp_system._get_status())
+
+        # Immedately return the prior info (without waiting for the task).
+        immediate_result = service.result_datatype(**prior_info)
+        return ua.Variant(immediate_result, ua.VariantType.ExtensionObject)
+
+    async def _respond_sync(self, service, *input_args):
+        """Respond to a call of an immediately returning service with the func's results."""
+        logger.info("INFO: Service %s request received. Returns async: %s. Input args: %s.",
+                    service.name, service.returns_async, input_args)
+        prior_info = self._get_prior_info(service, input_args, {})
+
+        # Call the sync returning func.
+        sync_results = service.func(*input_args)
+        prior_info.update(**sync_results)
+        await self.update_state(await self.fp_system._get_status())
+        immediate_result = service.result_datatype(**sync_results)
+        return ua.Variant(immediate_result, ua.VariantType.ExtensionObject)
 
     async def make_it_event_triggering(self, func, event_gen):
         """Wrap the func so its results are filled into an event that is finally triggered."""
+        event = event_gen.event     # the fields of the emitted event are attributes of this object.
+        initial_values = {}         # initial value of each result field set so far.
+
         # @uamethod  Not an uamethod. Would cause error.
         async def event_triggering_func(*input_args):
+            self._services_running += 1
+            self._poll_now.set()
             try:
-                print("HERE:", type(func), input_args)
                 res = await func(*input_args)
-            except Exception as e:
-                raise e                                 # todo: debug raise
-                event_gen.ServiceExecutionResult = 1    # 1==error
+            except Exception:
+                logger.exception("ERROR: Service %s failed.", func.__name__)
+                # Do not report the results of a previous call along with the error.
+                for name, val in initial_values.items():
+                    setattr(event, name, val)
+                event.ServiceExecutionResult = 1    # 1==error
+                await event_gen.trigger()
+                return
             else:
-                event_gen.ServiceExecutionResult = 0    # 0==success
+                event.ServiceExecutionResult = 0    # 0==success
                 for name, val in res.items():
-                    try:
-                        setattr(event_gen, name, val)
-                    except Exception:  # todo: error impossible? Then use dict_to_attribs().
-                        FpOpcuaLogger.info(f"INFO: FPSystem returned {name}={val}, which is not "
-                                           "part of the opcua interface and thus not displayed.")
+                    # Only fields of the event type are emitted, see Event.add_property().
+                    if name not in event.data_types:
+                        logger.info("INFO: FPSystem returned %s=%s, which is not part of the "
+                                    "opcua interface and thus not displayed.", name, val)
                         continue
+                    initial_values.setdefault(name, getattr(event, name))
+                    setattr(event, name, val)
                 # Triggering the event generator means emitting the event.
                 await event_gen.trigger()
             finally:
+                self._services_running -= 1
                 await self.update_state(await self.fp_system._get_status())
         return event_triggering_func
 
     async def update_state(self, status):
-        """Write the values of the assigned status dict to 'state' variables."""
+        """Write the values of the assigned status dict to 'state' variables. Values that did not
+            change since the last write are skipped. Return whether any value was written."""
+        changed = False
         for state_var_name, val in status.items():
-            if state_var_name in ('RunState', 'ResultState', 'ErrorType'):
-                ua_val = ua.DataValue(ua.Variant(val, ua.VariantType.SByte))
-            elif state_var_name in ('CurrentCommand'):
-                ua_val = ua.DataValue(ua.Variant(val, ua.VariantType.String))
-            else:
+            meta = self._state_meta.get(state_var_name)
+            if meta is None:
+                continue
+            if state_var_name in self._last_state and self._last_state[state_var_name] == val:
                 continue
-            await self.server.write_attribute_value(self.variables[state_var_name].nodeid, ua_val)
+            nodeid, variant_type = meta
+            await self.server.write_attribute_value(nodeid, state_data_value(val, variant_type))
+            self._last_state[state_var_name] = val
+            changed = True
+        if changed:
+            self._poll_now.set()
 #        print("STATE:", ", ".join( [f"{k}={v}" for k, v in status.items()] ))
-
-    async def periodic_state_update(self, interval=0.5):
-        """Every interval seconds, update the state of the opcua interface from the FpSystem."""
+        return changed
+
+    async def periodic_state_update(self, interval=0.5, min_interval=0.1, max_interval=2.0):
+        """Periodically update the state of the opcua interface from the FpSystem. Starting at
+            interval seconds, the period grows while the state is unchanged (up to max_interval).
+            It drops to min_interval as soon as any update_state() call writes a change or a service
+            starts, and stays there while a service is running, since the FpSystem changes its
+            status on its own then."""
         while True:
-            await self.update_state(await self.fp_system._get_status())
-            await asyncio.sleep(interval)
+            changed = await self.update_state(await self.fp_system._get_status())
+            if changed or self._services_running > 0:
+                interval = min_interval
+            else:
+                interval = min(interval * 1.5, max_interval)
+            # Sleep for interval, but wake up early on a state write or service start elsewhere.
+            self._poll_now.clear()
+            try:
+                await asyncio.wait_for(self._poll_now.wait(), interval)
+            except asyncio.TimeoutError:
+                pass
+            else:
+                interval = min_interval
+
+    def spawn_task(self, coro, name=None):
+        """Run coro in a new task, referenced in tasks_running until it is done."""
+        task = asyncio.get_running_loop().create_task(coro, name=name)
+        self.tasks_running.add(task)
+        task.add_done_callback(self._discard_task)
+        return task
+
+    async def cancel_tasks(self):
+        """Cancel all background tasks and wait until they are finished."""
+        tasks = tuple(self.tasks_running)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
 
     async def init_threads(self):
         """Start sets of threads that work in the background."""
-        event_loop = asyncio.get_event_loop()
-
-        task = event_loop.create_task(self.periodic_state_update(0.25), name='auto_update_fp_state')
-        self.tasks_running.add(task)
-        task.add_done_callback(self.tasks_running.discard)
+        self.spawn_task(self.periodic_state_update(0.25), name='auto_update_fp_state')